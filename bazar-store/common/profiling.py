@@ -0,0 +1,233 @@
+"""Opt-in request profiling for the Bazar.com Flask services.
+
+Services call install(app) at import time. It does nothing unless
+PROFILING_ENABLED=true is set: nothing is registered otherwise, so a
+service started without it runs exactly as before. Once enabled, a share of
+requests (PROFILING_SAMPLE_RATE, adjustable at runtime) is sampled by a
+background thread that records the request thread's call stack every
+PROFILING_INTERVAL_MS milliseconds, and every SQL statement run on a profiled
+request is timed.
+
+Results are exposed through:
+- GET    /admin/profiling            status, recent requests and SQL timings
+- POST   /admin/profiling            {"sample_rate": 0.1} to change the sample rate
+- DELETE /admin/profiling            clear collected data
+- GET    /admin/profiling/flamegraph collapsed stacks (flamegraph.pl / speedscope)
+- SIGUSR1                            write collapsed stacks to PROFILING_DUMP_DIR
+
+If PROFILING_TOKEN is set, the admin endpoints require it in the
+X-Profiling-Token header.
+"""
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Response, g, jsonify, request
+
+
+class RequestProfiler:
+    """Samples call stacks and SQL timings for a fraction of requests"""
+
+    def __init__(self, sample_rate=0.0, interval=0.005, max_requests=200,
+                 dump_dir='/tmp', token=None):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.dump_dir = dump_dir
+        self.token = token
+        self._lock = threading.Lock()
+        self._active = {}                  # thread ident -> request record
+        self._sampler = None
+        self._stacks = Counter()           # collapsed stack -> samples, all requests
+        self._sql = {}                     # statement -> {'calls', 'total_ms', 'max_ms'}
+        self._requests = deque(maxlen=max_requests)
+
+    @classmethod
+    def from_env(cls):
+        """Build a profiler from environment variables, or None when disabled"""
+        if os.environ.get('PROFILING_ENABLED') != 'true':
+            return None
+        return cls(
+            sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01')),
+            interval=float(os.environ.get('PROFILING_INTERVAL_MS', '5')) / 1000,
+            max_requests=int(os.environ.get('PROFILING_MAX_REQUESTS', '200')),
+            dump_dir=os.environ.get('PROFILING_DUMP_DIR', '/tmp'),
+            token=os.environ.get('PROFILING_TOKEN'),
+        )
+
+    def init_app(self, app):
+        """Register request hooks, admin endpoints and the dump signal"""
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+        app.add_url_rule('/admin/profiling', 'profiling_status',
+                         self._status_view, methods=['GET', 'POST', 'DELETE'])
+        app.add_url_rule('/admin/profiling/flamegraph', 'profiling_flamegraph',
+                         self._flamegraph_view, methods=['GET'])
+
+        # Signals can only be installed from the main thread, and SIGUSR1
+        # does not exist on Windows
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.dump())
+
+    def cursor_factory(self, base):
+        """Wrap a psycopg2 cursor class so statements are timed on profiled requests"""
+        profiler = self
+
+        class TimedCursor(base):
+            def execute(self, query, vars=None):
+                start = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    profiler.record_sql(query, time.perf_counter() - start)
+
+        return TimedCursor
+
+    def record_sql(self, query, duration):
+        record = self._active.get(threading.get_ident())
+        if record is None:
+            return
+        statement = ' '.join(str(query).split())
+        record['sql'].append({'query': statement, 'ms': round(duration * 1000, 3)})
+
+    def collapsed_stacks(self):
+        """Return samples in the collapsed 'frame;frame;frame count' format"""
+        with self._lock:
+            stacks = list(self._stacks.items())
+        return '\n'.join(f"{stack} {count}" for stack, count in sorted(stacks)) + '\n'
+
+    def dump(self):
+        path = os.path.join(self.dump_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+        with open(path, 'w') as f:
+            f.write(self.collapsed_stacks())
+        print(f"Wrote profiling samples to {path}")
+        return path
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._sql.clear()
+            self._requests.clear()
+
+    def _start_request(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return
+        if request.path.startswith('/admin/profiling'):
+            return
+
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'started': time.perf_counter(),
+            'stacks': Counter(),
+            'sql': [],
+        }
+        g._profile = record
+        with self._lock:
+            self._active[threading.get_ident()] = record
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop,
+                                                 name='request-profiler', daemon=True)
+                self._sampler.start()
+
+    def _finish_request(self, exc):
+        record = g.pop('_profile', None)
+        if record is None:
+            return
+
+        duration_ms = (time.perf_counter() - record['started']) * 1000
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            self._stacks.update(record['stacks'])
+            for statement in record['sql']:
+                stats = self._sql.setdefault(statement['query'],
+                                             {'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+                stats['calls'] += 1
+                stats['total_ms'] += statement['ms']
+                stats['max_ms'] = max(stats['max_ms'], statement['ms'])
+            self._requests.append({
+                'method': record['method'],
+                'path': record['path'],
+                'duration_ms': round(duration_ms, 3),
+                'error': str(exc) if exc else None,
+                'sql': record['sql'],
+                'top_stacks': record['stacks'].most_common(5),
+            })
+
+    def _sample_loop(self):
+        """Record the stack of every profiled request thread until none are left"""
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+
+                frames = sys._current_frames()
+                for ident, record in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        record['stacks'][_collapse(frame)] += 1
+
+    def _authorized(self):
+        return not self.token or request.headers.get('X-Profiling-Token') == self.token
+
+    def _status_view(self):
+        if not self._authorized():
+            return jsonify({'error': 'Unauthorized'}), 401
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            try:
+                sample_rate = float(data.get('sample_rate', self.sample_rate))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'sample_rate must be a number'}), 400
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        elif request.method == 'DELETE':
+            self.reset()
+
+        with self._lock:
+            sql = sorted(
+                ({'query': query, **stats} for query, stats in self._sql.items()),
+                key=lambda stats: stats['total_ms'], reverse=True,
+            )
+            recent = list(self._requests)
+
+        return jsonify({
+            'sample_rate': self.sample_rate,
+            'interval_ms': self.interval * 1000,
+            'requests': recent,
+            'sql': sql,
+        })
+
+    def _flamegraph_view(self):
+        if not self._authorized():
+            return jsonify({'error': 'Unauthorized'}), 401
+        return Response(self.collapsed_stacks(), mimetype='text/plain')
+
+
+def install(app, base_cursor=None):
+    """Profile `app` when PROFILING_ENABLED=true is set.
+
+    Returns the psycopg2 cursor class the service should connect with:
+    `base_cursor` itself, or a subclass that times statements when profiling
+    is on.
+    """
+    profiler = RequestProfiler.from_env()
+    if profiler is None:
+        return base_cursor
+    profiler.init_app(app)
+    return profiler.cursor_factory(base_cursor) if base_cursor is not None else None
+
+def _collapse(frame):
+    """Turn a frame into a root-first 'func (file:line);...' string"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
@@ -1,9 +1,14 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_file, abort, Response
 import requests
 import os
 import time
+import gzip
+import hashlib
+import assets
+from common import profiling
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+profiling.install(app)
 
 # Configure service URLs based on environment
 if os.environ.get('DOCKER_ENV') == 'true':
@@ -13,16 +18,87 @@ else:
     CATALOG_SERVICE_URL = os.environ.get('CATALOG_SERVICE_URL', "http://localhost:5000")
     ORDER_SERVICE_URL = os.environ.get('ORDER_SERVICE_URL', "http://localhost:5001")
 
-# Set a timeout for API requests to prevent hanging
+# Set a timeout for API requests to prevent hanging. The order service's
+# IDEMPOTENCY_WAIT (4s by default) must stay below it
 REQUEST_TIMEOUT = 5  # seconds
 
+# Number of books shown in recommendation lists
+RECOMMENDATION_LIMIT = 6
+
+# Fingerprinted asset bundles, see assets.py
+try:
+    ASSET_MANIFEST = assets.load_manifest()
+except Exception as e:
+    print(f"Error building static assets, falling back to unbundled scripts: {e}")
+    ASSET_MANIFEST = {}
+
+# Hashed filenames never change content, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Rendered index page, filled on first request
+_index_cache = {}
+
+@app.context_processor
+def inject_asset_url():
+    def asset_url(name):
+        filename = ASSET_MANIFEST.get(name)
+        return f"/assets/{filename}" if filename else None
+    return {'asset_url': asset_url}
+
+def preferred_encoding(available):
+    """Pick the best content coding the client accepts out of `available`"""
+    for encoding in ('br', 'gzip'):
+        if encoding in available and request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+def render_index():
+    """Render index.html once and keep compressed variants of it"""
+    body = render_template('index.html',
+                           catalog_url=CATALOG_SERVICE_URL,
+                           order_url=ORDER_SERVICE_URL).encode('utf-8')
+    variants = {None: body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if assets.brotli is not None:
+        variants['br'] = assets.brotli.compress(body, quality=11)
+    return {'variants': variants, 'etag': hashlib.sha256(body).hexdigest()[:16]}
+
 @app.route('/')
 def index():
     """Render the main page"""
-    # Pass the service URLs to the template
-    return render_template('index.html', 
-                          catalog_url=CATALOG_SERVICE_URL,
-                          order_url=ORDER_SERVICE_URL)
+    # Templates only depend on configuration, so render once unless debugging
+    if app.debug or 'page' not in _index_cache:
+        _index_cache['page'] = render_index()
+    page = _index_cache['page']
+
+    encoding = preferred_encoding(page['variants'])
+    response = Response(page['variants'][encoding], mimetype='text/html')
+    response.set_etag(f"{page['etag']}-{encoding}" if encoding else page['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response.make_conditional(request)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    """Serve a fingerprinted bundle, precompressed when the client allows it"""
+    if filename not in ASSET_MANIFEST.values():
+        abort(404)
+
+    path = os.path.join(assets.DIST_DIR, filename)
+    available = [encoding for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                 if os.path.exists(path + suffix)]
+    encoding = preferred_encoding(available)
+
+    response = send_file(path + {'br': '.br', 'gzip': '.gz'}.get(encoding, ''),
+                         mimetype='application/javascript',
+                         conditional=True,
+                         etag=f"{filename}-{encoding}" if encoding else filename)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/api/search/<topic>')
 def search(topic):
@@ -34,16 +110,41 @@ def search(topic):
         app.logger.error(f"Error in search endpoint: {str(e)}")
         return jsonify({'error': str(e), 'books': []}), 500
 
+def fetch_recommended_books(item_id=None, limit=RECOMMENDATION_LIMIT):
+    """Resolve precomputed recommendations from the order service into book records"""
+    path = f"/recommendations/{item_id}" if item_id is not None else "/recommendations"
+    response = requests.get(f"{ORDER_SERVICE_URL}{path}",
+                            params={'limit': limit},
+                            timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    item_ids = response.json().get('recommendations', [])
+    if not item_ids:
+        return []
+
+    response = requests.get(f"{CATALOG_SERVICE_URL}/info",
+                            params={'ids': ','.join(str(i) for i in item_ids)},
+                            timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get('books', [])
+
 @app.route('/api/search/recommended')
 def recommended():
     """Get recommended books"""
     try:
-        response = requests.get(f"{CATALOG_SERVICE_URL}/search/programming", timeout=REQUEST_TIMEOUT)
-        return jsonify(response.json())
+        return jsonify({'books': fetch_recommended_books()})
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error in recommended endpoint: {str(e)}")
         return jsonify({'error': str(e), 'books': []}), 500
 
+@app.route('/api/recommendations/<int:item_id>')
+def recommendations_for_book(item_id):
+    """Get books frequently bought together with a given book"""
+    try:
+        return jsonify({'books': fetch_recommended_books(item_id)})
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Error in recommendations endpoint: {str(e)}")
+        return jsonify({'error': str(e), 'books': []}), 500
+
 @app.route('/api/info/<item_id>')
 def info(item_id):
     """Get book details"""
@@ -54,12 +155,28 @@ def info(item_id):
         app.logger.error(f"Error in info endpoint: {str(e)}")
         return jsonify({'error': str(e), 'book': None}), 500
 
+@app.route('/api/info')
+def info_batch():
+    """Get details for several books at once (?ids=1,2,3)"""
+    try:
+        response = requests.get(f"{CATALOG_SERVICE_URL}/info",
+                                params={'ids': ','.join(request.args.getlist('ids'))},
+                                timeout=REQUEST_TIMEOUT)
+        return jsonify(response.json()), response.status_code
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Error in batch info endpoint: {str(e)}")
+        return jsonify({'error': str(e), 'books': []}), 500
+
 @app.route('/api/purchase/<item_id>', methods=['POST'])
 def purchase(item_id):
     """Process a purchase"""
     try:
+        headers = {}
+        if 'Idempotency-Key' in request.headers:
+            headers['Idempotency-Key'] = request.headers['Idempotency-Key']
         response = requests.post(f"{ORDER_SERVICE_URL}/purchase/{item_id}", 
                                 json=request.json, 
+                                headers=headers,
                                 timeout=REQUEST_TIMEOUT)
         return jsonify(response.json()), response.status_code
     except requests.exceptions.RequestException as e:
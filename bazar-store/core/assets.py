@@ -0,0 +1,216 @@
+"""Static asset pipeline for the core service.
+
+The page scripts are concatenated into one bundle, minified, written under a
+content-hashed filename and precompressed with gzip (and brotli when the
+`brotli` package is installed). A manifest maps logical names to the hashed
+files so templates can reference them with asset_url().
+
+Run `python assets.py` at image build time; the service builds the bundle on
+startup if no manifest is present.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Logical bundle name -> source files, in the order index.html loaded them
+BUNDLES = {
+    'js/bundle.js': ['js/main.js', 'js/special_offers.js', 'js/history.js'],
+}
+
+# Tokens after which a '/' starts a regex literal rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^') | {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new',
+    'delete', 'void', 'throw', 'yield', 'await', 'of',
+}
+
+
+def minify_js(source):
+    """Strip comments and collapse whitespace without touching strings or regexes.
+
+    Newlines are kept wherever whitespace contained one so automatic semicolon
+    insertion behaves exactly as in the original source.
+    """
+    out = []
+    i = 0
+    n = len(source)
+    last = ''            # last significant token emitted
+    template_depth = []  # brace depth for each open ${ ... } inside template literals
+    brace_depth = 0
+
+    while i < n:
+        c = source[i]
+
+        if c in ' \t\r\n':
+            start = i
+            while i < n and source[i] in ' \t\r\n':
+                i += 1
+            _separate(out, '\n' in source[start:i])
+            continue
+
+        if c == '/' and i + 1 < n and source[i + 1] == '/':
+            while i < n and source[i] != '\n':
+                i += 1
+            continue
+
+        if c == '/' and i + 1 < n and source[i + 1] == '*':
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            _separate(out, '\n' in source[i:end])
+            i = end
+            continue
+
+        if c == '/' and (not last or last in REGEX_PRECEDERS):
+            j = i + 1
+            in_class = False
+            while j < n and (source[j] != '/' or in_class):
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                j += 1
+            j += 1
+            while j < n and source[j].isalpha():
+                j += 1
+            out.append(source[i:j])
+            last = ')'
+            i = j
+            continue
+
+        if c in '\'"':
+            j = i + 1
+            while j < n and source[j] != c:
+                if source[j] == '\\':
+                    j += 1
+                j += 1
+            out.append(source[i:j + 1])
+            last = c
+            i = j + 1
+            continue
+
+        if c == '`' or (c == '}' and template_depth and template_depth[-1] == brace_depth):
+            # Copy template literal text verbatim up to its end or the next ${
+            if c == '}':
+                template_depth.pop()
+            j = i + 1
+            while j < n:
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '`':
+                    j += 1
+                    break
+                if source[j] == '$' and j + 1 < n and source[j + 1] == '{':
+                    j += 2
+                    template_depth.append(brace_depth)
+                    break
+                j += 1
+            out.append(source[i:j])
+            last = '{' if source[j - 1] == '{' else '`'
+            i = j
+            continue
+
+        if c.isalnum() or c in '_$':
+            # Whole words, so keywords like `return` are seen as one token
+            j = i + 1
+            while j < n and (source[j].isalnum() or source[j] in '_$'):
+                j += 1
+            last = source[i:j]
+            out.append(last)
+            i = j
+            continue
+
+        if c in '+-' and i + 1 < n and source[i + 1] == c:
+            # After an operand ++/-- is postfix and ends the expression, so a
+            # following '/' divides; prefix ++/-- is an operator like '+'
+            postfix = last and last not in REGEX_PRECEDERS
+            out.append(c + c)
+            last = ')' if postfix else c
+            i += 2
+            continue
+
+        if c == '{':
+            brace_depth += 1
+        elif c == '}':
+            brace_depth -= 1
+
+        out.append(c)
+        last = c
+        i += 1
+
+    return ''.join(out).strip() + '\n'
+
+
+def _separate(out, newline):
+    """Emit a single separator for a run of whitespace and comments"""
+    if not out:
+        return
+    if out[-1] in (' ', '\n'):
+        if newline:
+            out[-1] = '\n'
+    else:
+        out.append('\n' if newline else ' ')
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Build every bundle and write the manifest; returns the manifest"""
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+
+    for name, sources in BUNDLES.items():
+        parts = []
+        for source in sources:
+            with open(os.path.join(static_dir, source), encoding='utf-8') as f:
+                parts.append(minify_js(f.read()))
+        # Each file is its own statement list, so keep a separator between them
+        data = ';\n'.join(parts).encode('utf-8')
+
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(os.path.basename(name))
+        filename = f"{stem}.{digest}{ext}"
+        path = os.path.join(dist_dir, filename)
+
+        _write(path, data)
+        _write(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+
+        manifest[name] = filename
+        print(f"Built {name} -> {filename} ({len(data):,} bytes)")
+
+    _write(os.path.join(dist_dir, 'manifest.json'), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(manifest_path=MANIFEST_PATH, static_dir=STATIC_DIR):
+    """Read the manifest, building the assets first if they are missing or stale"""
+    if not os.path.exists(manifest_path):
+        return build(static_dir=static_dir)
+
+    built_at = os.path.getmtime(manifest_path)
+    sources = [source for sources in BUNDLES.values() for source in sources]
+    if any(os.path.getmtime(os.path.join(static_dir, source)) > built_at for source in sources):
+        return build(static_dir=static_dir)
+
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    build()
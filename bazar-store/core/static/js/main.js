@@ -243,6 +243,17 @@ async function fetchWithRetry(url, options = {}, retries = 3, delay = 1000) {
   }
 }
 
+/**
+ * Create a key that lets the server recognise retries of the same request
+ * @returns {string} - A unique idempotency key
+ */
+function newIdempotencyKey() {
+  if (window.crypto && typeof window.crypto.randomUUID === "function") {
+    return window.crypto.randomUUID()
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+}
+
 /**
  * Search for books by topic
  * @param {string} topic - The topic to search for
@@ -644,10 +655,12 @@ function purchaseBook(bookId, shippingAddress, paymentMethod) {
     payment_method: paymentMethod,
   }
 
+  // The same key is sent on every retry so the purchase is only made once
   fetchWithRetry(`/api/purchase/${bookId}`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
+      "Idempotency-Key": newIdempotencyKey(),
     },
     body: JSON.stringify(purchaseData),
   })
@@ -1014,3 +1027,5 @@ window.updateCartBadge = updateCartBadge
 window.showPurchaseHistory = showPurchaseHistory
 window.showToast = showToast
 window.cleanupModals = cleanupModals
+window.fetchWithRetry = fetchWithRetry
+window.newIdempotencyKey = newIdempotencyKey
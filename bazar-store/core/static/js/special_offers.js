@@ -365,6 +365,8 @@ function processPurchases(items, index, results, purchaseInfo) {
     payment_method: paymentMethod,
     customer_email: customerEmail,
     phone_number: phoneNumber,
+    // Every item after the first joins the order the first one created
+    order_id: purchaseInfo.orderId,
     discount_info: {
       has_discount: categoryDiscount,
       category: book.topic,
@@ -373,11 +375,14 @@ function processPurchases(items, index, results, purchaseInfo) {
     },
   }
 
-  // Make the purchase request
-  fetch(`/api/purchase/${book.id}`, {
+  // Make the purchase request. fetchWithRetry and newIdempotencyKey come from
+  // main.js, which is loaded first; the key is reused on every retry so each
+  // cart item is only bought once
+  window.fetchWithRetry(`/api/purchase/${book.id}`, {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
+      "Idempotency-Key": window.newIdempotencyKey(),
     },
     body: JSON.stringify(purchaseData),
   })
@@ -392,6 +397,9 @@ function processPurchases(items, index, results, purchaseInfo) {
     .then((result) => {
       // Add result and process next item
       results.push(result)
+      if (!purchaseInfo.orderId) {
+        purchaseInfo.orderId = result.order_id
+      }
       processPurchases(items, index + 1, results, purchaseInfo)
     })
     .catch((error) => {
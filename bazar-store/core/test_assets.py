@@ -0,0 +1,53 @@
+import unittest
+
+from assets import minify_js
+
+
+class MinifyJsTest(unittest.TestCase):
+    def test_strips_comments_and_indentation(self):
+        source = "/**\n * Header\n */\nfunction f() {\n    // note\n    return 1 /* inline */ + 2\n}\n"
+        self.assertEqual(minify_js(source), "function f() {\nreturn 1 + 2\n}\n")
+
+    def test_keeps_newlines_for_semicolon_insertion(self):
+        self.assertEqual(minify_js("let a = 1\n\n\nlet b = 2\n"), "let a = 1\nlet b = 2\n")
+
+    def test_leaves_strings_alone(self):
+        source = "const url = \"https://example.com/*x*/\"  ;  const s = 'a  // b \\' c'\n"
+        self.assertEqual(minify_js(source),
+                         "const url = \"https://example.com/*x*/\" ; const s = 'a  // b \\' c'\n")
+
+    def test_leaves_template_text_alone(self):
+        source = "const html = `<div>\n    ${items.map((i) => `<b>  ${ {a: i}.a }  </b>`).join(\"\")}\n  // not a comment\n</div>`\n"
+        self.assertEqual(minify_js(source), source)
+
+    def test_code_after_template_expression_is_minified(self):
+        source = "const s = `${ {x: 1}.x }`\n\n    const t = 2 // done\n"
+        self.assertEqual(minify_js(source), "const s = `${ {x: 1}.x }`\nconst t = 2\n")
+
+    def test_regex_after_punctuation(self):
+        source = "const re = /^[^\\s@]+@[/]  x$/g\nname.replace(/a  b/g, \"\")\n"
+        self.assertEqual(minify_js(source), source)
+
+    def test_regex_after_keyword(self):
+        self.assertEqual(minify_js("function f() {\n  return /a  b/.test(x)\n}\n"),
+                         "function f() {\nreturn /a  b/.test(x)\n}\n")
+        self.assertEqual(minify_js("if (typeof /a  b/ === 'object') {}\n"),
+                         "if (typeof /a  b/ === 'object') {}\n")
+
+    def test_division_is_not_a_regex(self):
+        self.assertEqual(minify_js("const x = total  /  count / (n)  /  2\n"),
+                         "const x = total / count / (n) / 2\n")
+
+    def test_division_after_postfix_increment(self):
+        self.assertEqual(minify_js('const r = i++  /  2; const s = "a"  /  2\n'),
+                         'const r = i++ / 2; const s = "a" / 2\n')
+        self.assertEqual(minify_js("const r = x--  /  2 // it's halved\n"),
+                         "const r = x-- / 2\n")
+
+    def test_regex_after_prefix_operator(self):
+        self.assertEqual(minify_js("const n = a + ++b\nconst m = c+++d\nconst ok = -/a  b/.test(x)\n"),
+                         "const n = a + ++b\nconst m = c+++d\nconst ok = -/a  b/.test(x)\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
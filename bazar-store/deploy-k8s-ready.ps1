@@ -21,19 +21,19 @@ Write-Host "Building and pushing Docker images..."
 
 # Build and push the catalog service
 Write-Host "Building catalog service image..."
-docker build -t $DOCKER_USERNAME/bazarcom-catalog:$IMAGE_TAG ./catalog
+docker build -f ./catalog/Dockerfile -t $DOCKER_USERNAME/bazarcom-catalog:$IMAGE_TAG .
 Write-Host "Pushing catalog service image..."
 docker push $DOCKER_USERNAME/bazarcom-catalog:$IMAGE_TAG
 
 # Build and push the order service
 Write-Host "Building order service image..."
-docker build -t $DOCKER_USERNAME/bazarcom-order:$IMAGE_TAG ./order
+docker build -f ./order/Dockerfile -t $DOCKER_USERNAME/bazarcom-order:$IMAGE_TAG .
 Write-Host "Pushing order service image..."
 docker push $DOCKER_USERNAME/bazarcom-order:$IMAGE_TAG
 
 # Build and push the core service
 Write-Host "Building core service image..."
-docker build -t $DOCKER_USERNAME/bazarcom-core:$IMAGE_TAG ./core
+docker build -f ./core/Dockerfile -t $DOCKER_USERNAME/bazarcom-core:$IMAGE_TAG .
 Write-Host "Pushing core service image..."
 docker push $DOCKER_USERNAME/bazarcom-core:$IMAGE_TAG
 
@@ -7,9 +7,14 @@ import uuid
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import time
+import threading
+from common import profiling
+from recommendations import CoPurchaseRecommender
+from idempotency import IdempotencyStore
 
 app = Flask(__name__)
 CORS(app)
+CURSOR_FACTORY = profiling.install(app, RealDictCursor)
 
 # Database connection
 if os.environ.get('DOCKER_ENV') == 'true':
@@ -24,7 +29,7 @@ def get_db_connection():
     retry_count = 0
     while retry_count < max_retries:
         try:
-            conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+            conn = psycopg2.connect(DATABASE_URL, cursor_factory=CURSOR_FACTORY)
             conn.autocommit = True
             return conn
         except Exception as e:
@@ -37,26 +42,65 @@ def init_db():
     conn = get_db_connection()
     cur = conn.cursor()
     
+    # One header row per order, holding everything shared by its line items
     cur.execute('''
-    CREATE TABLE IF NOT EXISTS orders (
+    CREATE TABLE IF NOT EXISTS order_headers (
+        order_id VARCHAR(20) PRIMARY KEY,
+        created_at TIMESTAMP NOT NULL,
+        customer_email VARCHAR(255),
+        shipping_address TEXT,
+        payment_method VARCHAR(50),
+        phone_number VARCHAR(20),
+        total_amount DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        item_count INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS order_items (
         id SERIAL PRIMARY KEY,
-        order_id VARCHAR(20) NOT NULL,
+        order_id VARCHAR(20) NOT NULL REFERENCES order_headers (order_id),
         item_id INTEGER NOT NULL,
-        timestamp TIMESTAMP NOT NULL,
         price DECIMAL(10, 2) NOT NULL,
         title VARCHAR(255) NOT NULL,
         author VARCHAR(255) NOT NULL,
-        shipping_address TEXT,
-        payment_method VARCHAR(50),
-        customer_email VARCHAR(255),
-        phone_number VARCHAR(20),
         original_price DECIMAL(10, 2),
         discount_amount DECIMAL(10, 2),
         discount_applied BOOLEAN DEFAULT FALSE
     )
     ''')
     
-    # Add missing columns if they don't exist
+    # Covering indexes so order listing and detail reads are index-only scans
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS order_headers_created_at_idx
+    ON order_headers (created_at DESC) INCLUDE (order_id, total_amount, item_count)
+    ''')
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS order_headers_customer_idx
+    ON order_headers (customer_email, created_at DESC) INCLUDE (order_id, total_amount, item_count)
+    ''')
+    cur.execute('''
+    CREATE INDEX IF NOT EXISTS order_items_order_id_idx
+    ON order_items (order_id, id) INCLUDE (item_id, price, title, author)
+    ''')
+    
+    migrate_legacy_orders(conn)
+    
+    cur.close()
+    conn.close()
+
+def migrate_legacy_orders(conn):
+    """Backfill order_headers/order_items from the old one-row-per-item orders table.
+
+    The old table is renamed to orders_legacy afterwards so the backfill runs once.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('public.orders') AS legacy")
+    if cur.fetchone()['legacy'] is None:
+        cur.close()
+        return
+    
+    # Very old tables may predate these columns, add them so the backfill can read them
     columns_to_add = {
         'shipping_address': 'TEXT',
         'payment_method': 'VARCHAR(50)',
@@ -76,8 +120,57 @@ def init_db():
             cur.execute(f"ALTER TABLE orders ADD COLUMN {column} {column_type}")
             print(f"Added {column} column to orders table")
     
-    cur.close()
-    conn.close()
+    conn.autocommit = False
+    try:
+        cur.execute('''
+        INSERT INTO order_headers (order_id, created_at, customer_email, shipping_address, payment_method,
+                                   phone_number, total_amount, item_count)
+        SELECT 
+            order_id,
+            MIN(timestamp),
+            MAX(customer_email),
+            MAX(shipping_address),
+            MAX(payment_method),
+            MAX(phone_number),
+            SUM(price),
+            COUNT(*)
+        FROM orders
+        GROUP BY order_id
+        ON CONFLICT (order_id) DO NOTHING
+        ''')
+        headers = cur.rowcount
+        
+        cur.execute('''
+        INSERT INTO order_items (order_id, item_id, price, title, author, original_price,
+                                 discount_amount, discount_applied)
+        SELECT order_id, item_id, price, title, author, original_price, discount_amount, discount_applied
+        FROM orders
+        ORDER BY id
+        ''')
+        items = cur.rowcount
+        
+        cur.execute('ALTER TABLE orders RENAME TO orders_legacy')
+        conn.commit()
+        print(f"Migrated {items} legacy order rows into {headers} orders")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+        cur.close()
+
+# Books tracked by the recommender; each costs about 1KB of memory
+recommender = CoPurchaseRecommender(max_items=int(os.environ.get('RECOMMENDER_MAX_ITEMS', '50000')))
+
+# Responses to purchases sent with an Idempotency-Key header, replayed on retries
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000')),
+    ttl=int(os.environ.get('IDEMPOTENCY_TTL', str(24 * 3600)))
+)
+# How long a replay waits for the original request to finish, in seconds. Keep
+# it below core's REQUEST_TIMEOUT (5s, core/app.py): the 503 that tells the
+# client to retry must reach core before core gives up and answers 500 itself
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '4'))
 
 try:
     init_db()
@@ -85,14 +178,85 @@ try:
 except Exception as e:
     print(f"Error initializing database: {e}")
 
+# Seconds to wait before retrying a failed recommendation matrix build
+RECOMMENDER_RETRY_INTERVAL = 30
+_recommender_state = {'last_attempt': 0.0, 'lock': threading.Lock()}
+
+def load_recommender():
+    """Build the recommendation matrix; returns False if the database was unavailable"""
+    # A build is already running, don't queue up behind it
+    if not _recommender_state['lock'].acquire(blocking=False):
+        return recommender.loaded
+    try:
+        if recommender.loaded:
+            return True
+        _recommender_state['last_attempt'] = time.monotonic()
+        conn = get_db_connection()
+        try:
+            loaded = recommender.load(conn)
+        finally:
+            conn.close()
+        print(f"Recommendation matrix built from {loaded} purchases of tracked books")
+        return True
+    except Exception as e:
+        print(f"Error building recommendation matrix: {e}")
+        return False
+    finally:
+        _recommender_state['lock'].release()
+
+def start_recommender_load():
+    """Build the recommendation matrix off the request path; recommend() returns [] until it is loaded"""
+    _recommender_state['last_attempt'] = time.monotonic()
+    threading.Thread(target=load_recommender, name='recommender-load', daemon=True).start()
+
+start_recommender_load()
+
 @app.route('/purchase/<int:item_id>', methods=['POST'])
 def purchase(item_id):
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        return process_purchase(item_id)
+    if len(key) > 255:
+        return jsonify({'success': False, 'message': 'Idempotency-Key is too long'}), 400
+    
+    store_key = f"{item_id}:{key}"
+    entry = idempotency_store.begin(store_key)
+    if entry is not None:
+        cached = idempotency_store.wait(entry, IDEMPOTENCY_WAIT)
+        if cached is None:
+            # Still running: a 5xx makes the client retry with the same key
+            response = jsonify({'success': False, 'message': 'A purchase with this Idempotency-Key is still in progress'})
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+            return response
+        body, status = cached
+        response = jsonify(body)
+        response.status_code = status
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    
+    try:
+        response = app.make_response(process_purchase(item_id))
+    except Exception:
+        idempotency_store.release(store_key)
+        raise
+    
+    # Server errors are not final, let the client's retry run the purchase again
+    if response.status_code >= 500:
+        idempotency_store.release(store_key)
+    else:
+        idempotency_store.finish(store_key, response.get_json(), response.status_code)
+    return response
+
+def process_purchase(item_id):
     purchase_data = request.json or {}
     shipping_address = purchase_data.get('shipping_address', '')
     payment_method = purchase_data.get('payment_method', '')
     customer_email = purchase_data.get('customer_email', '')
     phone_number = purchase_data.get('phone_number', '')
     discount_info = purchase_data.get('discount_info', {})
+    # Set by cart checkouts for every item after the first, so the cart is one order
+    order_id = purchase_data.get('order_id')
     
     response = requests.get(f"{CATALOG_SERVICE_URL}/info/{item_id}")
     if response.status_code != 200:
@@ -105,7 +269,6 @@ def purchase(item_id):
     if book_data['quantity'] <= 0:
         return jsonify({'success': False, 'message': 'Book is out of stock'}), 400
     
-    order_id = str(uuid.uuid4())[:8].upper()
     conn = get_db_connection()
     try:
         conn.autocommit = False
@@ -126,21 +289,50 @@ def purchase(item_id):
                 final_price = original_price - discount_amount
                 print(f"Applied {discount_percentage}% discount for category '{category}' with {category_count} books")
         
+        if order_id:
+            cur.execute('SELECT customer_email FROM order_headers WHERE order_id = %s FOR UPDATE', (order_id,))
+            header = cur.fetchone()
+            if not header or header['customer_email'] != customer_email:
+                conn.rollback()
+                return jsonify({'success': False, 'message': 'Order not found'}), 404
+            
+            cur.execute('SELECT item_id FROM order_items WHERE order_id = %s', (order_id,))
+            existing_items = [row['item_id'] for row in cur.fetchall()]
+            
+            cur.execute('''
+            UPDATE order_headers
+            SET total_amount = total_amount + %s, item_count = item_count + 1
+            WHERE order_id = %s
+            ''', (final_price, order_id))
+        else:
+            order_id = f"ORD-{str(uuid.uuid4())[:8].upper()}"
+            existing_items = []
+            
+            cur.execute('''
+            INSERT INTO order_headers (order_id, created_at, customer_email, shipping_address, payment_method,
+                                       phone_number, total_amount, item_count)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (
+                order_id,
+                timestamp,
+                customer_email,
+                shipping_address,
+                payment_method,
+                phone_number,
+                final_price,
+                1
+            ))
+        
         cur.execute('''
-        INSERT INTO orders (order_id, item_id, timestamp, price, title, author, shipping_address, payment_method, 
-                           customer_email, phone_number, original_price, discount_amount, discount_applied)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO order_items (order_id, item_id, price, title, author, original_price,
+                                 discount_amount, discount_applied)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         ''', (
-            f"ORD-{order_id}",
+            order_id,
             item_id,
-            timestamp,
             final_price,
             book_data['title'],
             book_data['author'],
-            shipping_address,
-            payment_method,
-            customer_email,
-            phone_number,
             original_price,
             discount_amount,
             discount_applied
@@ -156,11 +348,12 @@ def purchase(item_id):
             return jsonify({'success': False, 'message': 'Failed to update inventory'}), 500
         
         conn.commit()
+        recommender.record_order([item_id], existing_items)
         
         response_data = {
             'success': True,
             'message': 'Purchase successful',
-            'order_id': f"ORD-{order_id}",
+            'order_id': order_id,
             'book': book_data['title'],
             'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S')
         }
@@ -190,19 +383,23 @@ def purchase(item_id):
 
 @app.route('/orders', methods=['GET'])
 def get_orders():
+    customer_email = request.args.get('customer_email')
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute('''
-        SELECT 
-            order_id, 
-            MAX(timestamp) as order_date, 
-            SUM(price) as total_amount,
-            COUNT(*) as item_count
-        FROM orders 
-        GROUP BY order_id 
-        ORDER BY MAX(timestamp) DESC
-    ''')
+    if customer_email:
+        cur.execute('''
+            SELECT order_id, created_at AS order_date, total_amount, item_count
+            FROM order_headers
+            WHERE customer_email = %s
+            ORDER BY created_at DESC
+        ''', (customer_email,))
+    else:
+        cur.execute('''
+            SELECT order_id, created_at AS order_date, total_amount, item_count
+            FROM order_headers
+            ORDER BY created_at DESC
+        ''')
     orders = cur.fetchall()
     
     cur.close()
@@ -215,29 +412,31 @@ def get_order_details(order_id):
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute('SELECT * FROM orders WHERE order_id = %s', (order_id,))
-    items = cur.fetchall()
+    cur.execute('''
+        SELECT order_id, created_at AS order_date, total_amount, item_count,
+               shipping_address, payment_method
+        FROM order_headers
+        WHERE order_id = %s
+    ''', (order_id,))
+    order = cur.fetchone()
     
-    if not items:
+    if not order:
+        cur.close()
+        conn.close()
         return jsonify({'error': 'Order not found'}), 404
     
     cur.execute('''
-        SELECT 
-            order_id, 
-            MAX(timestamp) as order_date, 
-            SUM(price) as total_amount,
-            COUNT(*) as item_count,
-            MAX(shipping_address) as shipping_address,
-            MAX(payment_method) as payment_method
-        FROM orders 
+        SELECT id, order_id, item_id, title, author, price
+        FROM order_items
         WHERE order_id = %s
-        GROUP BY order_id
+        ORDER BY id
     ''', (order_id,))
-    order = cur.fetchone()
+    items = cur.fetchall()
     
     cur.close()
     conn.close()
     
+    order_date = order['order_date'].strftime('%Y-%m-%d %H:%M:%S') if order['order_date'] else None
     formatted_items = []
     for item in items:
         formatted_items.append({
@@ -247,11 +446,22 @@ def get_order_details(order_id):
             'title': item['title'],
             'author': item['author'],
             'price': float(item['price']),
-            'timestamp': item['timestamp'].strftime('%Y-%m-%d %H:%M:%S') if item['timestamp'] else None
+            'timestamp': order_date
         })
     
     return jsonify({'order': order, 'items': formatted_items})
 
+@app.route('/recommendations', methods=['GET'])
+@app.route('/recommendations/<int:item_id>', methods=['GET'])
+def recommendations(item_id=None):
+    limit = request.args.get('limit', 5, type=int)
+    limit = max(1, min(limit, 50))
+    # A failed startup build is retried in the background, at most once per interval
+    if (not recommender.loaded and
+            time.monotonic() - _recommender_state['last_attempt'] >= RECOMMENDER_RETRY_INTERVAL):
+        start_recommender_load()
+    return jsonify({'item_id': item_id, 'recommendations': recommender.recommend(item_id, limit)})
+
 @app.route('/health', methods=['GET'])
 def health():
     try:
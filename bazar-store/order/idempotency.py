@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyStore:
+    """Bounded, expiring map from idempotency keys to finished responses.
+
+    begin() claims a key for the first request that presents it. Replays of
+    a finished request get the stored (body, status) back; replays that arrive
+    while the original is still running wait for it to finish. Once
+    max_entries is reached the oldest finished entries are evicted; entries
+    still in flight are never evicted, so the store may briefly exceed its
+    bound. Every entry expires after ttl seconds.
+    """
+
+    def __init__(self, max_entries=10000, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {'expires', 'done', 'response'}
+
+    def begin(self, key):
+        """Claim `key`; returns None for a new key, else the entry to replay"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+
+            self._entries[key] = {
+                'expires': time.monotonic() + self.ttl,
+                'done': threading.Event(),
+                'response': None,
+            }
+            self._evict()
+            return None
+
+    def finish(self, key, body, status):
+        """Store the response for `key` and wake any waiting replays"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry['response'] = (body, status)
+            entry['done'].set()
+
+    def release(self, key):
+        """Forget `key` so a retry is processed from scratch"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry['done'].set()
+
+    def wait(self, entry, timeout):
+        """Wait for an in-flight entry; returns (body, status) or None"""
+        entry['done'].wait(timeout)
+        return entry['response']
+
+    def _evict(self):
+        """Drop the oldest finished entries until the store fits max_entries"""
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        # In-flight entries are few, so the scan normally stops after a handful
+        finished = []
+        for key, entry in self._entries.items():
+            if entry['done'].is_set():
+                finished.append(key)
+                if len(finished) == excess:
+                    break
+        for key in finished:
+            del self._entries[key]
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry['expires'] > now:
+                break
+            self._entries.popitem(last=False)
@@ -0,0 +1,182 @@
+import threading
+
+# Length of the global ranked list; recommend() never returns more
+TOP_K = 50
+
+# Co-purchase counters kept per book; recommend() tops up with popular books
+NEIGHBOURS_PER_ITEM = 10
+
+
+class CoPurchaseRecommender:
+    """Bounded in-memory co-purchase model built from the order_items table.
+
+    Two books are co-purchased when they share an order_id. Only the
+    `max_items` most purchased books are tracked, each with at most
+    NEIGHBOURS_PER_ITEM co-purchase counters, so memory stays flat however
+    large order_items grows. The counters are ranked in SQL once by load() and
+    kept current by calling record_order() for every completed purchase; a
+    book that is not tracked yet is added while there is room. Serving a
+    recommendation only copies a few short lists and never touches the
+    database or the catalog service.
+    """
+
+    def __init__(self, max_items=50000):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._popularity = {}   # tracked item_id -> times purchased
+        self._neighbours = {}   # tracked item_id -> {item_id: times bought together}
+        self._top = []          # top-K most purchased ids
+        self._pending = None    # orders recorded while load() runs
+        self.loaded = False
+
+    def load(self, conn):
+        """Rebuild the model from the order_items table.
+
+        PostgreSQL picks the tracked books and ranks their co-purchases with
+        ROW_NUMBER(), so only max_items * NEIGHBOURS_PER_ITEM rows are ever
+        read. Orders recorded while this runs are replayed on top afterwards.
+        """
+        with self._lock:
+            self._pending = []
+
+        popularity = {}
+        neighbours = {}
+        try:
+            autocommit = conn.autocommit
+            conn.autocommit = False  # named cursors only live inside a transaction
+            try:
+                cur = conn.cursor()
+                cur.execute('''
+                SELECT item_id, COUNT(*) AS purchases
+                FROM order_items
+                GROUP BY item_id
+                ORDER BY purchases DESC, item_id
+                LIMIT %s
+                ''', (self.max_items,))
+                for row in cur.fetchall():
+                    popularity[row['item_id']] = row['purchases']
+                    neighbours[row['item_id']] = {}
+                cur.close()
+
+                cur = conn.cursor(name='recommender_pairs')
+                cur.itersize = 10000
+                cur.execute('''
+                SELECT item_id, other_id, together
+                FROM (
+                    SELECT a.item_id, b.item_id AS other_id, COUNT(*) AS together,
+                           ROW_NUMBER() OVER (PARTITION BY a.item_id
+                                              ORDER BY COUNT(*) DESC, b.item_id) AS rank
+                    FROM order_items a
+                    JOIN order_items b ON a.order_id = b.order_id AND a.item_id <> b.item_id
+                    WHERE a.item_id = ANY(%s)
+                    GROUP BY a.item_id, b.item_id
+                ) ranked
+                WHERE rank <= %s
+                ''', (list(popularity), NEIGHBOURS_PER_ITEM))
+                for row in cur:
+                    neighbours[row['item_id']][row['other_id']] = row['together']
+                cur.close()
+                conn.rollback()
+            finally:
+                conn.autocommit = autocommit
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        top = sorted(popularity, key=lambda item_id: _key(popularity, item_id))[:TOP_K]
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._popularity = popularity
+            self._neighbours = neighbours
+            self._top = top
+            for item_ids, existing in pending:
+                self._record(item_ids, existing)
+            self.loaded = True
+
+        return sum(popularity.values())
+
+    def record_order(self, item_ids, existing=()):
+        """Add the books `item_ids` to an order that already held `existing`"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((list(item_ids), list(existing)))
+            else:
+                self._record(item_ids, existing)
+
+    def recommend(self, item_id=None, limit=5):
+        """Return up to `limit` item ids, best first.
+
+        With an item_id, books most often bought together with it are
+        returned, topped up with the most popular books. Without one, the
+        most popular books overall are returned.
+        """
+        with self._lock:
+            counts = dict(self._neighbours.get(item_id, ())) if item_id is not None else {}
+            top = list(self._top)
+
+        ranked = sorted(counts, key=lambda other: _key(counts, other))[:limit]
+        if len(ranked) < limit:
+            seen = set(ranked)
+            seen.add(item_id)
+            ranked.extend(other for other in top if other not in seen)
+
+        return ranked[:limit]
+
+    def _record(self, item_ids, existing):
+        for item_id in item_ids:
+            if item_id not in self._popularity:
+                if len(self._popularity) >= self.max_items:
+                    continue
+                self._popularity[item_id] = 0
+                self._neighbours[item_id] = {}
+            self._popularity[item_id] += 1
+            _bump(self._top, self._popularity, item_id)
+
+        added = set(item_ids)
+        basket = added | set(existing)
+        for item_id in basket:
+            counts = self._neighbours.get(item_id)
+            if counts is None:
+                continue
+            # Books already in the order only gain pairs with the new ones
+            for other in (basket if item_id in added else added):
+                if other != item_id:
+                    _count(counts, other)
+
+
+def _key(counts, item_id):
+    return (-counts[item_id], item_id)
+
+
+def _count(counts, item_id):
+    """Count item_id in a counter capped at NEIGHBOURS_PER_ITEM entries.
+
+    When the counter is full, the weakest entry is replaced and its count is
+    inherited (the space-saving algorithm), so a book bought together often
+    enough still works its way in.
+    """
+    if item_id in counts:
+        counts[item_id] += 1
+    elif len(counts) < NEIGHBOURS_PER_ITEM:
+        counts[item_id] = 1
+    else:
+        weakest = max(counts, key=lambda other: _key(counts, other))
+        counts[item_id] = counts.pop(weakest) + 1
+
+
+def _bump(ranked, counts, item_id):
+    """Keep `ranked` the top-K by `counts` after counts[item_id] went up.
+
+    Counts only grow, so an item can only enter the list by overtaking its
+    last entry; the list stays short enough that re-sorting it is cheap.
+    """
+    if item_id not in ranked:
+        if len(ranked) < TOP_K:
+            ranked.append(item_id)
+        elif _key(counts, item_id) < _key(counts, ranked[-1]):
+            ranked[-1] = item_id
+        else:
+            return
+    ranked.sort(key=lambda other: _key(counts, other))